@@ -6,7 +6,7 @@ import certifi
 from bson import ObjectId
 from dotenv import load_dotenv
 from gridfs import GridFS
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 
 load_dotenv()
 
@@ -60,6 +60,8 @@ def get_image(file_id: str) -> tuple[bytes, str] | None:
 def store_project(project_data: dict) -> str:
     """Insert a project document and return its id as a string."""
     project_data["created_at"] = datetime.now(timezone.utc)
+    # Bumped on every change clients can see; used as the project's ETag
+    project_data["version"] = 1
     result = db.projects.insert_one(project_data)
     logger.info("Stored project %s", result.inserted_id)
     return str(result.inserted_id)
@@ -73,6 +75,14 @@ def get_project(project_id: str) -> dict | None:
     return doc
 
 
+def get_project_version(project_id: str) -> int | None:
+    """Get only a project's version, or None if the project doesn't exist."""
+    doc = db.projects.find_one({"_id": ObjectId(project_id)}, {"version": 1})
+    if not doc:
+        return None
+    return doc.get("version", 0)
+
+
 def get_project_by_url(url: str) -> dict | None:
     """Find an existing project by its source URL."""
     doc = db.projects.find_one({"source_url": url})
@@ -82,9 +92,171 @@ def get_project_by_url(url: str) -> dict | None:
 
 
 def update_step_image(project_id: str, step_number: int, image_url: str) -> None:
-    """Update the image_url for a specific step in a project document."""
+    """Set the image_url for a step and mark its image generation as done."""
     db.projects.update_one(
         {"_id": ObjectId(project_id), "project.steps.step_number": step_number},
-        {"$set": {"project.steps.$.image_url": image_url}},
+        {
+            "$set": {
+                "project.steps.$.image_url": image_url,
+                "project.steps.$.image.status": "done",
+                "project.steps.$.image.last_error": None,
+                "project.steps.$.image.finished_at": datetime.now(timezone.utc),
+            },
+            "$inc": {"version": 1},
+        },
     )
     logger.info("Updated image_url for project %s, step %d", project_id, step_number)
+
+
+def _step_needs_image(stale_before: datetime) -> list[dict]:
+    """Conditions under which a step's image may be (re)generated.
+
+    Failed steps are deliberately absent: a step is only marked failed once its
+    attempts are used up, and from then on only reset_step_image revives it.
+    """
+    return [
+        # Stored before per-step image tracking existed
+        {"image_url": None, "image": {"$exists": False}},
+        {"image.status": "pending"},
+        *_step_needs_retry(stale_before),
+    ]
+
+
+def _step_needs_retry(stale_before: datetime) -> list[dict]:
+    """Conditions for steps whose earlier attempt failed or was abandoned."""
+    return [
+        {"image.status": "pending", "image.attempts": {"$gt": 0}},
+        # Abandoned by a worker that died mid-generation
+        {"image.status": "in_progress", "image.started_at": {"$lt": stale_before}},
+    ]
+
+
+def claim_step_image(
+    project_id: str, step_number: int, stale_before: datetime
+) -> dict | None:
+    """Atomically move a step's image to in progress and count the attempt.
+
+    Only succeeds if the step still needs an image, so concurrent workers (in
+    this or any other process) can't generate the same step twice. Returns the
+    claimed step, or None if there was nothing to claim.
+    """
+    doc = db.projects.find_one_and_update(
+        {
+            "_id": ObjectId(project_id),
+            "project.steps": {
+                "$elemMatch": {
+                    "step_number": step_number,
+                    "$or": _step_needs_image(stale_before),
+                }
+            },
+        },
+        {
+            "$set": {
+                "project.steps.$.image.status": "in_progress",
+                "project.steps.$.image.started_at": datetime.now(timezone.utc),
+                "project.steps.$.image.finished_at": None,
+            },
+            "$inc": {"project.steps.$.image.attempts": 1, "version": 1},
+        },
+        projection={"project.steps.$": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not doc:
+        return None
+    return doc["project"]["steps"][0]
+
+
+def mark_step_image_failed(
+    project_id: str, step_number: int, error: str, retry: bool
+) -> None:
+    """Record a failed attempt for a step's image.
+
+    With ``retry`` the step goes back to pending for the reconciler to pick up;
+    otherwise it is marked failed for good.
+    """
+    db.projects.update_one(
+        {"_id": ObjectId(project_id), "project.steps.step_number": step_number},
+        {
+            "$set": {
+                "project.steps.$.image.status": "pending" if retry else "failed",
+                "project.steps.$.image.last_error": error,
+                "project.steps.$.image.finished_at": datetime.now(timezone.utc),
+            },
+            "$inc": {"version": 1},
+        },
+    )
+    logger.info(
+        "Marked image %s for project %s, step %d",
+        "for retry" if retry else "failed",
+        project_id,
+        step_number,
+    )
+
+
+def reset_step_image(project_id: str, step_number: int, stale_before: datetime) -> bool:
+    """Put a step's image back to pending with a fresh attempt budget.
+
+    Leaves a step alone while it is being generated (unless that attempt has
+    gone stale). Returns whether the step was reset.
+    """
+    result = db.projects.update_one(
+        {
+            "_id": ObjectId(project_id),
+            "project.steps": {
+                "$elemMatch": {
+                    "step_number": step_number,
+                    "$or": [
+                        {"image.status": {"$ne": "in_progress"}},
+                        {"image.started_at": {"$lt": stale_before}},
+                    ],
+                }
+            },
+        },
+        {
+            "$set": {
+                "project.steps.$.image": {
+                    "status": "pending",
+                    "attempts": 0,
+                    "last_error": None,
+                    "started_at": None,
+                    "finished_at": None,
+                }
+            },
+            "$inc": {"version": 1},
+        },
+    )
+    return result.matched_count == 1
+
+
+def find_projects_needing_images(stale_before: datetime, limit: int = 50) -> list[dict]:
+    """Find projects with at least one step whose image should be (re)generated.
+
+    Matches steps that are pending, stuck in progress since before
+    ``stale_before``, or that predate per-step image tracking and still have no
+    image. Pending steps that were never attempted are left alone until the
+    project was created before ``stale_before``, since they normally belong to
+    the job queued when the project was stored.
+    """
+    cursor = db.projects.find(
+        {
+            "$or": [
+                {
+                    "project.steps": {
+                        "$elemMatch": {"$or": _step_needs_retry(stale_before)}
+                    }
+                },
+                {
+                    "created_at": {"$lt": stale_before},
+                    "project.steps": {
+                        "$elemMatch": {"$or": _step_needs_image(stale_before)}
+                    },
+                },
+            ]
+        },
+        limit=limit,
+    )
+    docs = []
+    for doc in cursor:
+        doc["_id"] = str(doc["_id"])
+        docs.append(doc)
+    return docs
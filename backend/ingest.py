@@ -0,0 +1,89 @@
+"""Pre-generate guides for a list of Instructables URLs.
+
+Usage:
+    python ingest.py urls.txt --checkpoint ingest.jsonl
+    cat urls.txt | python ingest.py - --checkpoint ingest.jsonl
+
+URLs are read one per line; blank lines and lines starting with '#' are
+ignored. Re-running with the same checkpoint file resumes where the previous
+run stopped, retrying only the URLs that failed or never finished.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from pathlib import Path
+
+from utils.batch import (
+    IMAGE_CONCURRENCY,
+    REPORT_INTERVAL,
+    SCRAPE_CONCURRENCY,
+    STRUCTURE_CONCURRENCY,
+    BatchIngestor,
+)
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "source",
+        nargs="?",
+        default="-",
+        help="File with one URL per line, or '-' for stdin (default)",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=Path,
+        help="JSONL file recording per-URL results, used to resume",
+    )
+    parser.add_argument("--scrape-concurrency", type=int, default=SCRAPE_CONCURRENCY)
+    parser.add_argument(
+        "--structure-concurrency", type=int, default=STRUCTURE_CONCURRENCY
+    )
+    parser.add_argument("--image-concurrency", type=int, default=IMAGE_CONCURRENCY)
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        default=REPORT_INTERVAL,
+        help="Seconds between throughput reports",
+    )
+    return parser.parse_args()
+
+
+def _read_urls(source: str) -> list[str]:
+    if source == "-":
+        return sys.stdin.readlines()
+    with open(source, encoding="utf-8") as f:
+        return f.readlines()
+
+
+async def _main(args: argparse.Namespace) -> int:
+    ingestor = BatchIngestor(
+        scrape_concurrency=args.scrape_concurrency,
+        structure_concurrency=args.structure_concurrency,
+        image_concurrency=args.image_concurrency,
+        checkpoint_path=args.checkpoint,
+        report_interval=args.report_interval,
+    )
+
+    # Read the whole list up front, off the event loop, so a slow pipe can't
+    # stall the stage workers while they wait for the next line
+    urls = await asyncio.to_thread(_read_urls, args.source)
+    try:
+        await ingestor.run(urls)
+    except Exception:
+        # Already logged and recorded in the stats; still print the summary
+        pass
+
+    stats = ingestor.stats
+    print(json.dumps(stats.as_dict(), indent=2))
+    return 1 if stats.failed or stats.error else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    sys.exit(asyncio.run(_main(_parse_args())))
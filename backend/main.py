@@ -1,32 +1,69 @@
 import asyncio
+import hmac
 import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
 import httpx
 
 from bson import ObjectId
 from db.database import (
     get_db,
-    store_image,
     store_project,
-    update_step_image,
     get_project,
     get_image,
     get_project_by_url,
+    get_project_version,
+    reset_step_image,
 )
 
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from brotli_asgi import BrotliMiddleware
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import ORJSONResponse, Response
 from models.instruction import Instruction, Project
-from pydantic import BaseModel, ValidationError
+from pydantic import BaseModel, Field, ValidationError
 from utils.chat import chat_with_project
 from utils.gemini import generate_instructions
+from utils.batch import (
+    BATCH_API_TOKEN,
+    MAX_BATCH_URLS,
+    get_batch_job,
+    start_batch_job,
+)
+from utils.images import (
+    STALE_IN_PROGRESS,
+    generate_project_images,
+    generate_step_image,
+    image_jobs,
+    run_image_reconciler,
+)
+from utils.ratelimit import (
+    CHAT_BURST,
+    CHAT_RATE_PER_MINUTE,
+    NEW_CHAT_BURST,
+    NEW_CHAT_RATE_PER_MINUTE,
+    REGENERATE_BURST,
+    REGENERATE_RATE_PER_MINUTE,
+    AdmissionController,
+    RateLimiter,
+    client_key,
+)
 from utils.scraper import scrape_site
-from utils.workers import generate_image
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="NanoCraft Backend")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pick up images left pending or failed by a previous run
+    reconciler = asyncio.create_task(run_image_reconciler())
+    yield
+    reconciler.cancel()
+
+
+app = FastAPI(title="NanoCraft Backend", lifespan=lifespan)
 
 origins = [
     "http://localhost:5173",
@@ -39,8 +76,38 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Retry-After"],
+)
+
+# Brotli for clients that accept it, gzip otherwise. Images are already
+# compressed, so they are served as-is.
+app.add_middleware(
+    BrotliMiddleware,
+    minimum_size=1000,
+    gzip_fallback=True,
+    excluded_handlers=["^/images/"],
 )
 
+# Limits on endpoints that fan out to paid upstream calls (Gemini, Workers AI)
+new_chat_limiter = RateLimiter("new-chat", NEW_CHAT_RATE_PER_MINUTE, NEW_CHAT_BURST)
+chat_limiter = RateLimiter("chat", CHAT_RATE_PER_MINUTE, CHAT_BURST)
+regenerate_limiter = RateLimiter(
+    "regenerate-image", REGENERATE_RATE_PER_MINUTE, REGENERATE_BURST
+)
+admission = AdmissionController()
+
+
+def _project_etag(project_id: str, version: int) -> str:
+    return f'W/"{project_id}-{version}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag."""
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag.removeprefix("W/") in candidates
+
 
 class NewChatRequest(BaseModel):
     instructables_url: str
@@ -51,11 +118,41 @@ class ChatMessageRequest(BaseModel):
     history: list[dict] = []
 
 
+class BatchIngestRequest(BaseModel):
+    urls: list[str] = Field(..., min_length=1, max_length=MAX_BATCH_URLS)
+    # Resume an earlier job from its checkpoint instead of starting a new one
+    job_id: str | None = None
+
+
+def _require_batch_token(request: Request) -> None:
+    """Batch ingest makes paid calls at scale, so it is limited to admins."""
+    if not BATCH_API_TOKEN:
+        raise HTTPException(status_code=403, detail="Batch ingest API is disabled")
+
+    auth = request.headers.get("authorization", "")
+    if not hmac.compare_digest(auth.encode(), f"Bearer {BATCH_API_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid batch API token")
+
+
 @app.get("/")
 async def root():
     return {"status": "NanoCraft backend running"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Expose admission and image queue depth and rate-limit rejection counts."""
+    return {
+        "admission": admission.stats(),
+        "image_jobs": image_jobs.stats(),
+        "rate_limits": {
+            new_chat_limiter.name: new_chat_limiter.stats(),
+            chat_limiter.name: chat_limiter.stats(),
+            regenerate_limiter.name: regenerate_limiter.stats(),
+        },
+    }
+
+
 @app.get("/test-db")
 def test_db():
     db = get_db()
@@ -63,76 +160,32 @@ def test_db():
     return {"inserted_id": str(result.inserted_id)}
 
 
-async def _generate_images_background(project_id: str, project_data: dict):
-    """Generate images sequentially, store in GridFS, and update project doc."""
-    successful = 0
-    failed = 0
-
-    for step in project_data["steps"]:
-        step_num = step["step_number"]
-        prompt = f"{project_data['visual_anchor']}. {step['scene_description']}"
-
-        try:
-            result = await generate_image(
-                image_id=str(step_num),
-                prompt=prompt,
-            )
-        except Exception as e:
-            failed += 1
-            logger.error("Image generation exception for step %s: %s", step_num, e)
-            continue
-
-        if result.get("success") and result.get("image_bytes"):
-            try:
-                gridfs_id = store_image(
-                    image_id=result["image_id"],
-                    image_bytes=result["image_bytes"],
-                )
-                image_url = f"/images/{gridfs_id}"
-                update_step_image(
-                    project_id=project_id,
-                    step_number=step_num,
-                    image_url=image_url,
-                )
-                successful += 1
-            except Exception as e:
-                failed += 1
-                logger.error("Failed to store image %s: %s", step_num, e)
-        else:
-            failed += 1
-            logger.error(
-                "Image gen failed for step %s: %s", step_num, result.get("error")
-            )
-
-        # Small delay between requests to avoid rate limits on Cloudflare
-        await asyncio.sleep(0.1)
-
-    logger.info(
-        "Image generation complete for project %s: %d ok, %d failed",
-        project_id,
-        successful,
-        failed,
-    )
-
-
-@app.post("/new-chat", response_model=Instruction)
-async def new_chat(payload: NewChatRequest):
+@app.post("/new-chat", response_model=Instruction, response_class=ORJSONResponse)
+async def new_chat(payload: NewChatRequest, request: Request, response: Response):
     try:
         # Check if project already exists for this URL
         existing_doc = get_project_by_url(payload.instructables_url)
         if existing_doc:
             logger.info("Found existing project for URL: %s", payload.instructables_url)
+            response.headers["ETag"] = _project_etag(
+                existing_doc["_id"], existing_doc.get("version", 0)
+            )
             return Instruction(
                 id=existing_doc["_id"],
                 source_url=existing_doc["source_url"],
-                project=Project(**existing_doc["project"]),
+                project=Project.from_document(existing_doc["project"]),
             )
 
-        scraped_content = await scrape_site(payload.instructables_url)
-        if not scraped_content:
-            raise HTTPException(status_code=400, detail="Failed to scrape content")
+        new_chat_limiter.check(client_key(request))
+        # Fail fast before paying for Gemini if images couldn't be queued
+        image_jobs.check()
+
+        async with admission.slot():
+            scraped_content = await scrape_site(payload.instructables_url)
+            if not scraped_content:
+                raise HTTPException(status_code=400, detail="Failed to scrape content")
 
-        project: Project = await generate_instructions(scraped_content)
+            project: Project = await generate_instructions(scraped_content)
 
         project_data = project.model_dump()
 
@@ -143,8 +196,15 @@ async def new_chat(payload: NewChatRequest):
         }
         project_id = store_project(doc)
 
+        response.headers["ETag"] = _project_etag(project_id, doc["version"])
+
         # Background image generation
-        asyncio.create_task(_generate_images_background(project_id, project_data))
+        try:
+            image_jobs.submit(generate_project_images, project_id, project_data)
+        except HTTPException:
+            # The project is already paid for; its steps stay pending and the
+            # reconciler generates them once there is capacity
+            logger.warning("Image queue full, deferring images for %s", project_id)
 
         return Instruction(
             id=project_id,
@@ -168,23 +228,41 @@ async def new_chat(payload: NewChatRequest):
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 
-@app.get("/projects/{project_id}")
-async def get_project_endpoint(project_id: str):
-    """Return a project with current image URLs (for polling)"""
+@app.get("/projects/{project_id}", response_class=ORJSONResponse)
+async def get_project_endpoint(project_id: str, request: Request):
+    """Return a project with current image URLs (for polling).
+
+    Answers 304 when the client's ETag still matches the project version, so
+    unchanged polls skip loading and serializing the document."""
     try:
         ObjectId(project_id)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid project ID")
 
+    headers = {"Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        version = get_project_version(project_id)
+        if version is None:
+            raise HTTPException(status_code=404, detail="Project not found")
+        etag = _project_etag(project_id, version)
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={**headers, "ETag": etag})
+
     doc = get_project(project_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Project not found")
 
-    return {
-        "id": doc["_id"],
-        "source_url": doc.get("source_url", ""),
-        "project": doc.get("project", {}),
-    }
+    headers["ETag"] = _project_etag(doc["_id"], doc.get("version", 0))
+    return ORJSONResponse(
+        {
+            "id": doc["_id"],
+            "source_url": doc.get("source_url", ""),
+            "project": doc.get("project", {}),
+        },
+        headers=headers,
+    )
 
 
 @app.get("/images/{file_id}")
@@ -203,8 +281,47 @@ async def get_image_endpoint(file_id: str):
     return Response(content=image_bytes, media_type=content_type)
 
 
+@app.post("/projects/{project_id}/steps/{step_number}/image", status_code=202)
+async def regenerate_step_image(project_id: str, step_number: int, request: Request):
+    """Regenerate the image for a single step in the background."""
+    try:
+        ObjectId(project_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid project ID")
+
+    doc = get_project(project_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    project_data = doc.get("project", {})
+    step = next(
+        (s for s in project_data.get("steps", []) if s["step_number"] == step_number),
+        None,
+    )
+    if step is None:
+        raise HTTPException(status_code=404, detail="Step not found")
+
+    regenerate_limiter.check(client_key(request))
+    image_jobs.check()
+
+    # A step still in progress is only taken over once it has gone stale
+    stale_before = datetime.now(timezone.utc) - STALE_IN_PROGRESS
+    if not reset_step_image(project_id, step_number, stale_before):
+        raise HTTPException(
+            status_code=409, detail="This step's image is already being generated"
+        )
+
+    # The job claims the step atomically, so concurrent requests that all got
+    # this far still only generate it once
+    image_jobs.submit(
+        generate_step_image, project_id, project_data["visual_anchor"], step
+    )
+
+    return {"project_id": project_id, "step_number": step_number, "status": "pending"}
+
+
 @app.post("/projects/{project_id}/chat")
-async def project_chat(project_id: str, payload: ChatMessageRequest):
+async def project_chat(project_id: str, payload: ChatMessageRequest, request: Request):
     """Send a message to the AI chatbot in the context of a project"""
     try:
         ObjectId(project_id)
@@ -215,17 +332,44 @@ async def project_chat(project_id: str, payload: ChatMessageRequest):
     if not doc:
         raise HTTPException(status_code=404, detail="Project not found")
 
+    chat_limiter.check(client_key(request))
+
     try:
-        response_text = await chat_with_project(
-            project_data=doc,
-            message=payload.message,
-            history=payload.history,
-        )
+        async with admission.slot():
+            response_text = await chat_with_project(
+                project_data=doc,
+                message=payload.message,
+                history=payload.history,
+            )
         return {"response": response_text}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error("Chat error for project %s: %s", project_id, e)
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 
+@app.post("/batch/ingest", status_code=202)
+async def batch_ingest(payload: BatchIngestRequest, request: Request):
+    """Pre-generate guides for a list of URLs in the background."""
+    _require_batch_token(request)
+
+    job_id = start_batch_job(payload.urls, resume_job_id=payload.job_id)
+
+    return {"job_id": job_id, "submitted": len(payload.urls)}
+
+
+@app.get("/batch/ingest/{job_id}")
+async def batch_ingest_status(job_id: str, request: Request):
+    """Return progress and throughput for a batch ingest job."""
+    _require_batch_token(request)
+
+    job = get_batch_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+
+    return {"job_id": job_id, **job.stats.as_dict()}
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -1,13 +1,39 @@
+from datetime import datetime
+from enum import Enum
 from typing import List, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+from pydantic.json_schema import SkipJsonSchema
+
+
+class ImageStatus(str, Enum):
+    # A failed attempt with retries left goes back to PENDING with last_error
+    # set; FAILED means the retries are used up
+    PENDING = "pending"
+    IN_PROGRESS = "in_progress"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class StepImage(BaseModel):
+    """Generation state of a step's image, persisted with the project."""
+
+    model_config = ConfigDict(use_enum_values=True)
+
+    status: ImageStatus = Field(default=ImageStatus.PENDING, validate_default=True)
+    attempts: int = 0
+    last_error: Optional[str] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
 
 
 class Step(BaseModel):
     step_number: int
     scene_description: str
     alt_text: str
-    image_url: Optional[str] = None
+    # Hidden from the schema sent to Gemini; filled in by the image pipeline
+    image_url: SkipJsonSchema[Optional[str]] = None
+    image: SkipJsonSchema[StepImage] = Field(default_factory=StepImage)
 
 
 class Project(BaseModel):
@@ -18,6 +44,21 @@ class Project(BaseModel):
     visual_anchor: str
     steps: List[Step]
 
+    @classmethod
+    def from_document(cls, data: dict) -> "Project":
+        """Build a Project from a stored document.
+
+        Steps stored before image tracking only have an image_url, so mark
+        those as done rather than pending.
+        """
+        steps = [
+            {**step, "image": {"status": ImageStatus.DONE}}
+            if "image" not in step and step.get("image_url")
+            else step
+            for step in data.get("steps", [])
+        ]
+        return cls.model_validate({**data, "steps": steps})
+
 
 class Instruction(BaseModel):
     id: Optional[str] = None
@@ -0,0 +1,326 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterable
+
+from bson import ObjectId
+from db.database import get_project_by_url, store_project
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from utils.gemini import generate_instructions
+from utils.images import generate_project_images, image_jobs
+from utils.scraper import scrape_site
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SCRAPE_CONCURRENCY = 4
+STRUCTURE_CONCURRENCY = 2
+IMAGE_CONCURRENCY = 2
+REPORT_INTERVAL = 30
+
+# Settings for batch jobs started through the API
+BATCH_API_TOKEN = os.environ.get("BATCH_API_TOKEN")
+MAX_BATCH_URLS = int(os.environ.get("MAX_BATCH_URLS", "1000"))
+MAX_RUNNING_BATCH_JOBS = int(os.environ.get("MAX_RUNNING_BATCH_JOBS", "1"))
+MAX_TRACKED_BATCH_JOBS = 50
+BATCH_CHECKPOINT_DIR = Path(os.environ.get("BATCH_CHECKPOINT_DIR", "temp/batch"))
+
+_JOB_ID_RE = re.compile(r"^[0-9a-f]{24}$")
+
+# Statuses that mean a URL is finished and can be skipped on resume
+_DONE_STATUSES = {"created", "exists"}
+
+# Marks the end of a stage's input; each worker re-queues it for its siblings
+_END = object()
+
+
+@dataclass
+class BatchStats:
+    queued: int = 0
+    created: int = 0
+    exists: int = 0
+    resumed: int = 0
+    failed: int = 0
+    images_ok: int = 0
+    images_failed: int = 0
+    finished: bool = False
+    # Set when the pipeline itself crashed rather than a single URL failing
+    error: str | None = None
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: float | None = None
+
+    @property
+    def processed(self) -> int:
+        return self.created + self.exists + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+    def as_dict(self) -> dict:
+        elapsed = self.elapsed
+        return {
+            "queued": self.queued,
+            "processed": self.processed,
+            "created": self.created,
+            "exists": self.exists,
+            "resumed": self.resumed,
+            "failed": self.failed,
+            "images_ok": self.images_ok,
+            "images_failed": self.images_failed,
+            "finished": self.finished,
+            "error": self.error,
+            "elapsed_seconds": round(elapsed, 1),
+            "urls_per_minute": round(self.processed / elapsed * 60, 2)
+            if elapsed > 0
+            else 0.0,
+        }
+
+
+def load_checkpoint(path: Path) -> set[str]:
+    """Return the URLs a previous run already finished (created or existing)."""
+    done: set[str] = set()
+    if not path.exists():
+        return done
+
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A torn final line from a killed run is expected; skip it
+                continue
+            if entry.get("status") in _DONE_STATUSES:
+                done.add(entry["url"])
+    return done
+
+
+class BatchIngestor:
+    """Stream URLs through the scrape -> structure -> image stages.
+
+    Each stage runs its own pool of workers connected by bounded queues, so a
+    slow stage applies backpressure to the ones before it instead of letting
+    work pile up in memory.
+    """
+
+    def __init__(
+        self,
+        scrape_concurrency: int = SCRAPE_CONCURRENCY,
+        structure_concurrency: int = STRUCTURE_CONCURRENCY,
+        image_concurrency: int = IMAGE_CONCURRENCY,
+        checkpoint_path: Path | None = None,
+        report_interval: float = REPORT_INTERVAL,
+        stats: BatchStats | None = None,
+    ):
+        self.scrape_concurrency = scrape_concurrency
+        self.structure_concurrency = structure_concurrency
+        self.image_concurrency = image_concurrency
+        self.checkpoint_path = checkpoint_path
+        self.report_interval = report_interval
+        self.stats = stats or BatchStats()
+
+    def _record(self, url: str, status: str, **extra: Any) -> None:
+        setattr(self.stats, status, getattr(self.stats, status) + 1)
+        if self.checkpoint_path is None:
+            return
+        entry = {"url": url, "status": status, **extra}
+        with self.checkpoint_path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    async def _scrape(self, url: str) -> dict | None:
+        existing = get_project_by_url(url)
+        if existing:
+            self._record(url, "exists", project_id=existing["_id"])
+            return None
+
+        content = await scrape_site(url)
+        return {"url": url, "content": content}
+
+    async def _structure(self, item: dict) -> dict:
+        project = await generate_instructions(item["content"])
+        project_data = project.model_dump()
+        project_id = store_project({"source_url": item["url"], "project": project_data})
+        return {"url": item["url"], "project_id": project_id, "project": project_data}
+
+    async def _images(self, item: dict) -> None:
+        summary = await image_jobs.run(
+            generate_project_images, item["project_id"], item["project"]
+        )
+        self.stats.images_ok += summary["successful"]
+        self.stats.images_failed += summary["failed"]
+        self._record(item["url"], "created", project_id=item["project_id"])
+
+    async def _run_stage(
+        self,
+        inbox: asyncio.Queue,
+        outbox: asyncio.Queue | None,
+        concurrency: int,
+        handler: Callable[[Any], Awaitable[Any]],
+    ) -> None:
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is _END:
+                    await inbox.put(_END)
+                    return
+                try:
+                    result = await handler(item)
+                except Exception as e:
+                    url = item if isinstance(item, str) else item["url"]
+                    logger.error("Batch ingest failed for %s: %s", url, e)
+                    self._record(url, "failed", error=str(e))
+                    continue
+                if result is not None and outbox is not None:
+                    await outbox.put(result)
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            # Don't leave siblings running if one worker crashed
+            for task in workers:
+                task.cancel()
+        if outbox is not None:
+            await outbox.put(_END)
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(self.report_interval)
+            logger.info("Batch ingest progress: %s", self.stats.as_dict())
+
+    async def _feed(self, urls: Iterable[str], done: set[str], queue: asyncio.Queue):
+        seen: set[str] = set()
+        for raw in urls:
+            url = raw.strip()
+            if not url or url.startswith("#") or url in seen:
+                continue
+            seen.add(url)
+            if url in done:
+                self.stats.resumed += 1
+                continue
+            self.stats.queued += 1
+            await queue.put(url)
+        await queue.put(_END)
+
+    async def run(self, urls: Iterable[str]) -> BatchStats:
+        """Ingest every URL in ``urls`` and return the final stats.
+
+        If a stage itself crashes, rather than a single URL failing, every stage
+        is cancelled and the error is recorded in the stats and re-raised.
+        """
+        done = load_checkpoint(self.checkpoint_path) if self.checkpoint_path else set()
+
+        scrape_q: asyncio.Queue = asyncio.Queue(maxsize=self.scrape_concurrency * 2)
+        structure_q: asyncio.Queue = asyncio.Queue(
+            maxsize=self.structure_concurrency * 2
+        )
+        image_q: asyncio.Queue = asyncio.Queue(maxsize=self.image_concurrency * 2)
+
+        stages = [
+            asyncio.create_task(
+                self._run_stage(
+                    scrape_q, structure_q, self.scrape_concurrency, self._scrape
+                )
+            ),
+            asyncio.create_task(
+                self._run_stage(
+                    structure_q, image_q, self.structure_concurrency, self._structure
+                )
+            ),
+            asyncio.create_task(
+                self._run_stage(image_q, None, self.image_concurrency, self._images)
+            ),
+        ]
+        reporter = asyncio.create_task(self._report())
+
+        # Fed from its own task so a dead scrape stage can't block it on a full queue
+        feeder = asyncio.create_task(self._feed(urls, done, scrape_q))
+
+        try:
+            await asyncio.gather(feeder, *stages)
+        except Exception as e:
+            logger.error("Batch ingest aborted: %s", e)
+            self.stats.error = str(e)
+            raise
+        finally:
+            reporter.cancel()
+            for task in (feeder, *stages):
+                task.cancel()
+            self.stats.finished = True
+            self.stats.finished_at = time.monotonic()
+
+        logger.info("Batch ingest complete: %s", self.stats.as_dict())
+        return self.stats
+
+
+@dataclass
+class BatchJob:
+    stats: BatchStats
+    task: asyncio.Task
+    checkpoint_path: Path
+
+
+# Batch jobs started through the API, oldest first. Holding the task here also
+# keeps it from being garbage-collected while it runs.
+_jobs: OrderedDict[str, BatchJob] = OrderedDict()
+
+
+def _evict_finished_jobs() -> None:
+    finished = [job_id for job_id, job in _jobs.items() if job.task.done()]
+    while len(_jobs) > MAX_TRACKED_BATCH_JOBS and finished:
+        del _jobs[finished.pop(0)]
+
+
+def _log_job_result(job_id: str, task: asyncio.Task) -> None:
+    if task.cancelled():
+        logger.warning("Batch job %s was cancelled", job_id)
+        return
+    # Retrieving the exception also stops asyncio warning it was never seen
+    error = task.exception()
+    if error is not None:
+        logger.error("Batch job %s failed: %s", job_id, error, exc_info=error)
+
+
+def start_batch_job(urls: list[str], resume_job_id: str | None = None) -> str:
+    """Start a checkpointed batch job in the background and return its id.
+
+    Passing the id of an earlier job resumes it from its checkpoint file.
+    """
+    if resume_job_id is not None and not _JOB_ID_RE.match(resume_job_id):
+        raise HTTPException(status_code=400, detail="Invalid batch job ID")
+
+    running = sum(1 for job in _jobs.values() if not job.task.done())
+    if running >= MAX_RUNNING_BATCH_JOBS:
+        raise HTTPException(
+            status_code=429,
+            detail="A batch job is already running, please retry later",
+            headers={"Retry-After": str(REPORT_INTERVAL)},
+        )
+
+    job_id = resume_job_id or str(ObjectId())
+    BATCH_CHECKPOINT_DIR.mkdir(parents=True, exist_ok=True)
+    checkpoint_path = BATCH_CHECKPOINT_DIR / f"{job_id}.jsonl"
+
+    ingestor = BatchIngestor(checkpoint_path=checkpoint_path)
+    task = asyncio.create_task(ingestor.run(urls))
+    task.add_done_callback(functools.partial(_log_job_result, job_id))
+    _jobs.pop(job_id, None)
+    _jobs[job_id] = BatchJob(ingestor.stats, task, checkpoint_path)
+    _evict_finished_jobs()
+
+    logger.info("Started batch job %s with %d URL(s)", job_id, len(urls))
+    return job_id
+
+
+def get_batch_job(job_id: str) -> BatchJob | None:
+    return _jobs.get(job_id)
@@ -76,7 +76,9 @@ async def chat_with_project(
         )
     )
 
-    response = client.models.generate_content(
+    # The async client keeps the event loop free, so other requests (and the
+    # admission queue's timeouts) keep running while Gemini responds
+    response = await client.aio.models.generate_content(
         model=str(GEMINI_MODEL),
         contents=contents,
         config=types.GenerateContentConfig(
@@ -28,7 +28,8 @@ async def generate_instructions(content: str) -> Project:
     prompt = f"{SYSTEM_PROMPT}\n\nDIY TEXT\n\n{content}"
 
     try:
-        response = client.models.generate_content(
+        # The async client keeps the event loop free while Gemini responds
+        response = await client.aio.models.generate_content(
             model=str(GEMINI_MODEL),
             contents=prompt,
             config=types.GenerateContentConfig(
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from db.database import (
+    claim_step_image,
+    find_projects_needing_images,
+    mark_step_image_failed,
+    store_image,
+    update_step_image,
+)
+from dotenv import load_dotenv
+from utils.ratelimit import MAX_IMAGE_JOBS, MAX_QUEUED_IMAGE_JOBS, JobLimiter
+from utils.workers import generate_image
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MAX_IMAGE_ATTEMPTS = int(os.environ.get("MAX_IMAGE_ATTEMPTS", "3"))
+# A step still in progress after this long is assumed to belong to a dead worker
+STALE_IN_PROGRESS = timedelta(
+    seconds=float(os.environ.get("IMAGE_STALE_SECONDS", "600"))
+)
+RECONCILE_INTERVAL = float(os.environ.get("IMAGE_RECONCILE_INTERVAL", "300"))
+
+# Every image job (new projects, single-step regeneration, batch ingest and
+# the reconciler) runs under this cap, so Workers AI calls stay bounded
+image_jobs = JobLimiter("image-jobs", MAX_IMAGE_JOBS, MAX_QUEUED_IMAGE_JOBS)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # PyMongo returns naive datetimes that are implicitly UTC
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def needs_image(step: dict, stale_before: datetime) -> bool:
+    """Whether a step's image should be (re)generated.
+
+    Only a cheap pre-check on a possibly outdated copy of the step;
+    ``claim_step_image`` makes the authoritative decision.
+    """
+    image = step.get("image")
+    if image is None:
+        # Stored before per-step tracking existed
+        return not step.get("image_url")
+
+    status = image.get("status")
+    if status == "pending":
+        return True
+    if status == "in_progress":
+        started_at = image.get("started_at")
+        return started_at is None or _as_utc(started_at) < stale_before
+    return False
+
+
+def _stale_before() -> datetime:
+    return datetime.now(timezone.utc) - STALE_IN_PROGRESS
+
+
+async def generate_step_image(
+    project_id: str, visual_anchor: str, step: dict
+) -> bool | None:
+    """Generate, store and record the image for one step.
+
+    Returns whether it succeeded, or None if the step didn't need an image or
+    another worker already claimed it.
+    """
+    step_num = step["step_number"]
+
+    claimed = claim_step_image(project_id, step_num, _stale_before())
+    if claimed is None:
+        logger.info("Step %s of project %s already claimed", step_num, project_id)
+        return None
+
+    prompt = f"{visual_anchor}. {claimed['scene_description']}"
+    # Failures with attempts left go back to pending for the reconciler
+    retry = claimed["image"]["attempts"] < MAX_IMAGE_ATTEMPTS
+
+    try:
+        result = await generate_image(
+            image_id=str(step_num),
+            prompt=prompt,
+        )
+    except Exception as e:
+        logger.error("Image generation exception for step %s: %s", step_num, e)
+        mark_step_image_failed(project_id, step_num, str(e), retry)
+        return False
+
+    if not (result.get("success") and result.get("image_bytes")):
+        error = result.get("error") or "Image generation returned no image"
+        logger.error("Image gen failed for step %s: %s", step_num, error)
+        mark_step_image_failed(project_id, step_num, error, retry)
+        return False
+
+    try:
+        gridfs_id = store_image(
+            image_id=result["image_id"],
+            image_bytes=result["image_bytes"],
+        )
+        update_step_image(
+            project_id=project_id,
+            step_number=step_num,
+            image_url=f"/images/{gridfs_id}",
+        )
+    except Exception as e:
+        logger.error("Failed to store image %s: %s", step_num, e)
+        mark_step_image_failed(
+            project_id, step_num, f"Failed to store image: {e}", retry
+        )
+        return False
+
+    return True
+
+
+async def generate_project_images(project_id: str, project_data: dict) -> dict:
+    """Generate images sequentially for every step that still needs one.
+
+    Steps that are already done, failed too many times, or claimed by another
+    worker are skipped, so calling this again on a partially finished project
+    resumes it.
+
+    Returns a summary dict with the number of successful and failed steps.
+    """
+    successful = 0
+    failed = 0
+    stale_before = _stale_before()
+
+    for step in project_data["steps"]:
+        if not needs_image(step, stale_before):
+            continue
+
+        result = await generate_step_image(
+            project_id, project_data["visual_anchor"], step
+        )
+        if result is None:
+            continue
+        if result:
+            successful += 1
+        else:
+            failed += 1
+
+        # Small delay between requests to avoid rate limits on Cloudflare
+        await asyncio.sleep(0.1)
+
+    logger.info(
+        "Image generation complete for project %s: %d ok, %d failed",
+        project_id,
+        successful,
+        failed,
+    )
+    return {"successful": successful, "failed": failed}
+
+
+async def reconcile_images() -> int:
+    """Regenerate steps whose images are missing, awaiting a retry or abandoned.
+
+    Returns the number of projects processed.
+    """
+    docs = find_projects_needing_images(_stale_before())
+
+    # One project at a time so a backlog doesn't burst Workers AI. The copies
+    # may be minutes old by the time a project's turn comes; each step is
+    # claimed atomically before generating, so work already done or in progress
+    # elsewhere is skipped.
+    for doc in docs:
+        await image_jobs.run(generate_project_images, doc["_id"], doc["project"])
+
+    if docs:
+        logger.info("Image reconciler processed %d project(s)", len(docs))
+    return len(docs)
+
+
+async def run_image_reconciler() -> None:
+    """Periodically reconcile image state until cancelled."""
+    while True:
+        try:
+            await reconcile_images()
+        except Exception as e:
+            logger.error("Image reconciler failed: %s", e)
+        await asyncio.sleep(RECONCILE_INTERVAL)
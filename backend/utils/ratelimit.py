@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MAX_TRACKED_CLIENTS = 10_000
+
+NEW_CHAT_RATE_PER_MINUTE = float(os.environ.get("NEW_CHAT_RATE_PER_MINUTE", "5"))
+NEW_CHAT_BURST = int(os.environ.get("NEW_CHAT_BURST", "3"))
+CHAT_RATE_PER_MINUTE = float(os.environ.get("CHAT_RATE_PER_MINUTE", "20"))
+CHAT_BURST = int(os.environ.get("CHAT_BURST", "5"))
+REGENERATE_RATE_PER_MINUTE = float(os.environ.get("REGENERATE_RATE_PER_MINUTE", "5"))
+REGENERATE_BURST = int(os.environ.get("REGENERATE_BURST", "3"))
+
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", "8"))
+MAX_QUEUED_REQUESTS = int(os.environ.get("MAX_QUEUED_REQUESTS", "16"))
+QUEUE_TIMEOUT = float(os.environ.get("QUEUE_TIMEOUT", "10"))
+BUSY_RETRY_AFTER = float(os.environ.get("BUSY_RETRY_AFTER", "5"))
+
+MAX_IMAGE_JOBS = int(os.environ.get("MAX_IMAGE_JOBS", "4"))
+MAX_QUEUED_IMAGE_JOBS = int(os.environ.get("MAX_QUEUED_IMAGE_JOBS", "32"))
+
+# Number of trusted reverse proxies in front of the app. 0 ignores
+# X-Forwarded-For entirely.
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "0"))
+
+
+def _too_many_requests(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+def client_key(request: Request) -> str:
+    """Identify the client a request came from.
+
+    Proxies append to X-Forwarded-For, so only entries counted from the right
+    were written by infrastructure we trust. Anything further left is whatever
+    the client sent and could be used to pick a fresh bucket per request.
+    """
+    if TRUSTED_PROXY_HOPS > 0:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            hops = [hop.strip() for hop in forwarded.split(",")]
+            if len(hops) >= TRUSTED_PROXY_HOPS:
+                return hops[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+
+class RateLimiter:
+    """Per-client token buckets.
+
+    Each client gets ``burst`` tokens that refill at ``rate_per_minute``. Only
+    the most recently seen clients are tracked, so memory stays bounded.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate_per_minute: float,
+        burst: int,
+        max_clients: int = MAX_TRACKED_CLIENTS,
+    ):
+        self.name = name
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_clients = max_clients
+        self.rejected = 0
+        # client key -> (tokens, last refill time)
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def check(self, key: str) -> None:
+        """Take one token for ``key`` or raise a 429 with Retry-After."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (float(self.burst), now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            allowed = True
+        else:
+            self._buckets[key] = (tokens, now)
+            allowed = False
+
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+
+        if not allowed:
+            self.rejected += 1
+            logger.warning("Rate limit hit on %s for client %s", self.name, key)
+            raise _too_many_requests(
+                "Rate limit exceeded, please slow down",
+                (1 - tokens) / self.rate,
+            )
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_minute": self.rate * 60,
+            "burst": self.burst,
+            "tracked_clients": len(self._buckets),
+            "rejected": self.rejected,
+        }
+
+
+class AdmissionController:
+    """Process-wide cap on concurrent expensive requests.
+
+    Up to ``max_concurrent`` requests run at once and up to ``max_queued`` wait
+    for a slot. Anything beyond that, or anything that waits longer than
+    ``queue_timeout`` seconds, is rejected immediately with a 429.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = MAX_CONCURRENT_REQUESTS,
+        max_queued: int = MAX_QUEUED_REQUESTS,
+        queue_timeout: float = QUEUE_TIMEOUT,
+        retry_after: float = BUSY_RETRY_AFTER,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    @asynccontextmanager
+    async def slot(self):
+        if not self._semaphore.locked():
+            # Free slot, acquire() returns without waiting
+            await self._semaphore.acquire()
+        elif self.queued >= self.max_queued:
+            self.rejected_queue_full += 1
+            logger.warning(
+                "Admission queue full (%d running, %d queued), shedding request",
+                self.in_flight,
+                self.queued,
+            )
+            raise _too_many_requests(
+                "Server is busy, please retry shortly", self.retry_after
+            )
+        else:
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected_timeout += 1
+                logger.warning("Request timed out waiting for an admission slot")
+                raise _too_many_requests(
+                    "Server is busy, please retry shortly", self.retry_after
+                ) from None
+            finally:
+                self.queued -= 1
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+        }
+
+
+class JobLimiter:
+    """Process-wide cap on background jobs that make paid upstream calls.
+
+    Up to ``max_concurrent`` jobs run at once and the rest wait their turn.
+    ``submit()`` is for jobs started on behalf of a request: once
+    ``max_queued`` jobs are already waiting it rejects with a 429 instead of
+    piling up more tasks. ``run()`` is for internal callers such as the batch
+    pipeline and reconciler, which already limit their own concurrency and
+    simply wait for a slot.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrent: int,
+        max_queued: int,
+        retry_after: float = BUSY_RETRY_AFTER,
+    ):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self.running = 0
+        self.queued = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        # Keep references so pending tasks aren't garbage-collected mid-run
+        self._tasks: set[asyncio.Task] = set()
+
+    async def run(self, func: Callable[..., Awaitable[Any]], *args: Any) -> Any:
+        """Wait for a slot, then run ``func(*args)``."""
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+
+        self.running += 1
+        try:
+            return await func(*args)
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+
+    def check(self) -> None:
+        """Raise a 429 if a newly submitted job would overflow the queue."""
+        if self.running + self.queued >= self.max_concurrent + self.max_queued:
+            self.rejected += 1
+            logger.warning(
+                "%s queue full (%d running, %d queued), rejecting job",
+                self.name,
+                self.running,
+                self.queued,
+            )
+            raise _too_many_requests(
+                "Server is busy, please retry shortly", self.retry_after
+            )
+
+    def submit(self, func: Callable[..., Awaitable[Any]], *args: Any) -> asyncio.Task:
+        """Schedule ``func(*args)`` in the background or raise a 429."""
+        self.check()
+
+        # Count the job as queued right away so back-to-back submits see it
+        self.queued += 1
+        task = asyncio.create_task(self._run_submitted(func, *args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run_submitted(self, func: Callable[..., Awaitable[Any]], *args: Any):
+        self.queued -= 1
+        try:
+            return await self.run(func, *args)
+        except Exception as e:
+            logger.error("%s job failed: %s", self.name, e)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "running": self.running,
+            "queue_depth": self.queued,
+            "rejected": self.rejected,
+        }
@@ -53,8 +53,8 @@ const Workspace: React.FC<WorkspaceProps> = ({ project }) => {
 
   // Poll for image updates
   useEffect(() => {
-    const allImagesLoaded = steps.every((s) => s.imageUrl);
-    if (allImagesLoaded) return;
+    const allImagesSettled = steps.every((s) => s.imageUrl || s.imageFailed);
+    if (allImagesSettled) return;
 
     pollingRef.current = setInterval(async () => {
       try {
@@ -64,11 +64,17 @@ const Workspace: React.FC<WorkspaceProps> = ({ project }) => {
             const match = updated.steps.find(
               (u) => u.stepNumber === s.stepNumber,
             );
-            return match?.imageUrl ? { ...s, imageUrl: match.imageUrl } : s;
+            if (!match) return s;
+            return {
+              ...s,
+              imageUrl: match.imageUrl ?? s.imageUrl,
+              imageFailed: match.imageFailed,
+              imageError: match.imageError,
+            };
           }),
         );
 
-        if (updated.steps.every((s) => s.imageUrl)) {
+        if (updated.steps.every((s) => s.imageUrl || s.imageFailed)) {
           if (pollingRef.current) clearInterval(pollingRef.current);
         }
       } catch (err) {
@@ -290,6 +296,17 @@ const Workspace: React.FC<WorkspaceProps> = ({ project }) => {
                       className="w-full h-full object-contain"
                       style={{ maxHeight: "100%" }}
                     />
+                  ) : currentStep.imageFailed ? (
+                    <div className="absolute inset-0 flex flex-col items-center justify-center gap-3 px-6 text-center">
+                      <p className="text-xs uppercase tracking-widest text-red-400/70">
+                        Visual unavailable
+                      </p>
+                      {currentStep.imageError && (
+                        <p className="text-[11px] text-stone-light/40 leading-snug max-w-sm">
+                          {currentStep.imageError}
+                        </p>
+                      )}
+                    </div>
                   ) : (
                     <div className="absolute inset-0 flex flex-col items-center justify-center gap-4">
                       <div className="relative w-12 h-12">
@@ -396,7 +413,12 @@ const Workspace: React.FC<WorkspaceProps> = ({ project }) => {
                             >
                               Step {step.stepNumber}
                             </h3>
-                            {!step.imageUrl ? (
+                            {step.imageFailed && !step.imageUrl ? (
+                              <span
+                                className="w-1.5 h-1.5 rounded-full bg-red-400/70"
+                                title={step.imageError || "Image unavailable"}
+                              />
+                            ) : !step.imageUrl ? (
                               <span
                                 className="w-1.5 h-1.5 rounded-full bg-clay/50 animate-pulse"
                                 title="Generating image…"
@@ -5,6 +5,11 @@ export interface BackendStep {
   scene_description: string;
   alt_text: string;
   image_url?: string;
+  image?: {
+    status: "pending" | "in_progress" | "done" | "failed";
+    attempts: number;
+    last_error?: string | null;
+  };
 }
 
 export interface BackendProject {
@@ -32,6 +37,9 @@ function mapBackendToProject(data: BackendInstruction): Project {
       sceneDescription: s.scene_description,
       altText: s.alt_text,
       imageUrl: s.image_url ? `${API_URL}${s.image_url}` : undefined,
+      // "failed" is only reported once the backend has used up its retries
+      imageFailed: s.image?.status === "failed",
+      imageError: s.image?.last_error ?? undefined,
       isCompleted: false,
     })),
   };
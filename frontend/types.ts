@@ -3,6 +3,8 @@ export interface Step {
   sceneDescription: string;
   altText: string;
   imageUrl?: string;
+  imageFailed?: boolean;
+  imageError?: string;
   isCompleted: boolean;
 }
 